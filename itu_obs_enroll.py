@@ -3,12 +3,35 @@
 
 """Simple timed enrollment script for ITU OBS."""
 
+import base64
+import json
+import os
+import sys
+import threading
 import time
 from datetime import datetime
-from typing import List, Optional, Tuple
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Tuple
 
 import requests
 import getpass
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
+
+# Python 3.11+ already sleeps on a high-resolution timer on Windows; older versions need
+# the ~15.6 ms system timer raised for the final sleep before the spin window.
+if sys.platform == "win32" and sys.version_info < (3, 11):
+    import ctypes
+
+    _winmm = ctypes.WinDLL("winmm")
+else:
+    _winmm = None
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 try:
     from obs_login import get_jwt
@@ -23,6 +46,33 @@ DROP_CRNS: List[str] = []
 
 DERS_KAYIT_URL = "https://obs.itu.edu.tr/api/ders-kayit/v21"
 
+# wait_until() busy-waits only for this final stretch before the target time.
+SPIN_WINDOW_SEC = 0.02
+# ... and sleeps coarsely until this close to it, then once more, finely, to the spin window.
+FINE_WAIT_SEC = 1.0
+
+# Warm the connection this long before the target: late enough that the server keeps
+# the idle socket open, early enough that the handshake is done before the POST.
+WARMUP_LEAD_SEC = 5.0
+# Per connect/read phase, so even a stalled warm-up ends before the target.
+WARMUP_TIMEOUT_SEC = 2
+
+# The warm-up only needs a socket; a retry or Retry-After sleep would just hold it up.
+_WARMUP_RETRY = Retry(0, read=False, respect_retry_after_header=False)
+
+# DEBUG=1 also prints response headers for successful requests.
+DEBUG = os.getenv("DEBUG", "0") == "1"
+# print_response() shows at most this many bytes of the body.
+BODY_PRINT_LIMIT = 1024
+
+# Refresh the JWT only when it expires within this many seconds.
+TOKEN_REFRESH_SKEW_SEC = 60
+
+# Re-check the JWT this long before the target (ahead of the warm-up), refreshing it if it
+# would expire within TOKEN_WAIT_SKEW_SEC; leaves time for a browser login if needed.
+TOKEN_CHECK_LEAD_SEC = 180
+TOKEN_WAIT_SKEW_SEC = 300
+
 USER_AGENT = (
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
     "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
@@ -34,22 +84,60 @@ def log(msg: str) -> None:
     print(f"[{ts}] {msg}", flush=True)
 
 
+_DEFAULT_HEADERS: Mapping[str, str] = MappingProxyType({
+    "User-Agent": USER_AGENT,
+    "Accept": "application/json",
+    "Accept-Language": "tr-TR,tr;q=0.9,en;q=0.8",
+    "Content-Type": "application/json",
+    "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
+    "sec-ch-ua-mobile": "?0",
+    "sec-ch-ua-platform": '"Windows"',
+    "Sec-Fetch-Dest": "empty",
+    "Sec-Fetch-Mode": "cors",
+    "Sec-Fetch-Site": "same-origin",
+    "Priority": "u=1, i",
+})
+
+
 def default_headers() -> dict:
-    return {
-        "User-Agent": USER_AGENT,
-        "Accept": "application/json",
-        "Accept-Language": "tr-TR,tr;q=0.9,en;q=0.8",
-        "Content-Type": "application/json",
-        "sec-ch-ua": '"Not_A Brand";v="8", "Chromium";v="120", "Google Chrome";v="120"',
-        "sec-ch-ua-mobile": "?0",
-        "sec-ch-ua-platform": '"Windows"',
-        "Sec-Fetch-Dest": "empty",
-        "Sec-Fetch-Mode": "cors",
-        "Sec-Fetch-Site": "same-origin",
-        "Priority": "u=1, i",
-    }
+    return dict(_DEFAULT_HEADERS)
+
+
+@lru_cache(maxsize=2)
+def build_headers_with_auth(token: Optional[str]) -> Mapping[str, str]:
+    """Read-only request headers for ``token``, built once per token."""
+    if not token:
+        return _DEFAULT_HEADERS
+    return MappingProxyType({**_DEFAULT_HEADERS, "Authorization": f"Bearer {token}"})
+
+
+def dumps_json(obj) -> bytes:
+    """Serialize a request body, with orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj).encode("utf-8")
 
 
+@lru_cache(maxsize=4)
+def enrollment_body(add_crns: Tuple[str, ...], drop_crns: Tuple[str, ...]) -> bytes:
+    """Encoded ders-kayit body, serialized once per CRN combination."""
+    return dumps_json({"ECRN": list(add_crns), "SCRN": list(drop_crns)})
+
+
+def make_session() -> requests.Session:
+    """Session with a sized keep-alive pool and retries for transient gateway errors."""
+    session = requests.Session()
+    adapter = HTTPAdapter(
+        pool_connections=4,
+        pool_maxsize=16,
+        max_retries=Retry(total=2, backoff_factor=0.1, status_forcelist=[502, 503, 504]),
+    )
+    session.mount("https://", adapter)
+    session.headers.update(default_headers())
+    return session
+
+
+@lru_cache(maxsize=8)
 def parse_target_time(target: str) -> Tuple[int, int, int, int]:
     parts = target.strip().replace(",", ".").split(".")
     time_part = parts[0]
@@ -59,7 +147,37 @@ def parse_target_time(target: str) -> Tuple[int, int, int, int]:
     return h, m, s, micro
 
 
-def wait_until(target_time_str: str) -> None:
+def warm_connection(session: requests.Session) -> None:
+    """Open the TCP+TLS connection to the enrollment host so the POST reuses it."""
+    # Send through a no-retry adapter that shares the session's pools, so the socket
+    # opened here is the one the POST picks up.
+    session_adapter = session.get_adapter(DERS_KAYIT_URL)
+    adapter = HTTPAdapter(max_retries=_WARMUP_RETRY)
+    adapter.poolmanager = session_adapter.poolmanager
+    adapter.proxy_manager = session_adapter.proxy_manager
+    request = session.prepare_request(requests.Request("HEAD", DERS_KAYIT_URL))
+    # Same proxy/verify/cert as Session.request() resolves for the POST (env vars included);
+    # a different CA bundle would key a different pool and force a fresh handshake.
+    settings = session.merge_environment_settings(DERS_KAYIT_URL, {}, None, None, None)
+    try:
+        resp = adapter.send(request, timeout=WARMUP_TIMEOUT_SEC, **settings)
+        resp.content  # read to the end so the connection goes back to the pool
+    except requests.RequestException as exc:
+        log(f"Connection warm-up failed: {exc}")
+
+
+def wait_until(
+    target_time_str: str,
+    warmup: Optional[Callable[[], None]] = None,
+    refresh: Optional[Callable[[], None]] = None,
+) -> None:
+    """Block until the target time; start ``refresh`` TOKEN_CHECK_LEAD_SEC and ``warmup``
+    WARMUP_LEAD_SEC before it.
+
+    Both run on background threads so a slow login or server cannot delay the target. A
+    refresh still running at WARMUP_LEAD_SEC is no longer waited for: the POST goes out with
+    the token in hand, and the refresh only takes effect whenever it finishes.
+    """
     h, m, s, micro = parse_target_time(target_time_str)
     now = datetime.now()
     target_today = now.replace(hour=h, minute=m, second=s, microsecond=micro)
@@ -67,20 +185,72 @@ def wait_until(target_time_str: str) -> None:
         log(f"Target time is in the past today: {target_time_str}. Exiting.")
         raise SystemExit(1)
 
+    # Convert the wall-clock target into a deadline on perf_counter(), which is monotonic
+    # (unaffected by NTP adjustments) and high-resolution on every platform.
+    deadline = time.perf_counter() + (target_today - datetime.now()).total_seconds()
     log(f"Waiting until {target_time_str} ...")
+    refresh_thread: Optional[threading.Thread] = None
     while True:
-        now = datetime.now()
-        if now >= target_today:
+        remaining = deadline - time.perf_counter()
+        if refresh is not None and remaining <= TOKEN_CHECK_LEAD_SEC:
+            refresh_thread = threading.Thread(target=refresh, daemon=True)
+            refresh_thread.start()
+            refresh = None
+            continue
+        if refresh_thread is not None:
+            if remaining > WARMUP_LEAD_SEC:
+                # usually the check returns at once; wake up as soon as it does
+                refresh_thread.join(remaining - WARMUP_LEAD_SEC)
+            elif refresh_thread.is_alive():
+                log("JWT refresh still running; the POST will use the current JWT.")
+            if not refresh_thread.is_alive() or remaining <= WARMUP_LEAD_SEC:
+                refresh_thread = None
+            continue
+        if warmup is not None and remaining <= WARMUP_LEAD_SEC:
+            threading.Thread(target=warmup, daemon=True).start()
+            warmup = None
+            continue
+        if remaining <= FINE_WAIT_SEC:
             break
-        delta = (target_today - now).total_seconds()
-        if delta > 1.0:
-            time.sleep(min(0.5, delta / 2))
-        elif delta > 0.01:
-            time.sleep(delta)
-        # last ~10ms: busy-wait (no sleep)
+        if refresh is not None:
+            wake_at = TOKEN_CHECK_LEAD_SEC
+        elif warmup is not None:
+            wake_at = WARMUP_LEAD_SEC
+        else:
+            wake_at = FINE_WAIT_SEC
+        time.sleep(remaining - wake_at)
+
+    if _winmm is not None:
+        # raised only for this last sleep, not for the whole wait
+        _winmm.timeBeginPeriod(1)
+    try:
+        remaining = deadline - time.perf_counter()
+        if remaining > SPIN_WINDOW_SEC:
+            time.sleep(remaining - SPIN_WINDOW_SEC)
+        # last SPIN_WINDOW_SEC: busy-wait, time.sleep() cannot wake up this precisely
+        while time.perf_counter() < deadline:
+            pass
+    finally:
+        if _winmm is not None:
+            _winmm.timeEndPeriod(1)
     log("Target time reached.")
 
 
+def print_response(resp: requests.Response) -> None:
+    print(f"Status: {resp.status_code}", flush=True)
+    if DEBUG or resp.status_code != 200:
+        print(f"Headers: {dict(resp.headers)}", flush=True)
+    # Bounded dump in the charset declared by Content-Type; resp.text would decode the
+    # whole body and run charset detection when none is declared.
+    try:
+        body = resp.content[:BODY_PRINT_LIMIT].decode(resp.encoding or "utf-8", "replace")
+    except LookupError:  # unknown charset name in the header
+        body = resp.content[:BODY_PRINT_LIMIT].decode("utf-8", "replace")
+    if len(resp.content) > BODY_PRINT_LIMIT:
+        body += f"... ({len(resp.content)} bytes)"
+    print(f"Body: {body}", flush=True)
+
+
 def prompt_time(default: str) -> str:
     s = input(f"Target time (HH:MM:SS.mmm) [{default}]: ").strip()
     return s or default
@@ -94,20 +264,43 @@ def prompt_crns(label: str) -> List[str]:
 
 
 def send_request(session: requests.Session, token: Optional[str]) -> Tuple[requests.Response, Optional[str]]:
-    headers = default_headers()
-    if token:
-        headers["Authorization"] = f"Bearer {token}"
-    body = {"ECRN": ADD_CRNS, "SCRN": DROP_CRNS}
-    resp = session.post(DERS_KAYIT_URL, json=body, headers=headers, timeout=30)
+    body = enrollment_body(tuple(ADD_CRNS), tuple(DROP_CRNS))
+    resp = session.post(DERS_KAYIT_URL, data=body, headers=build_headers_with_auth(token), timeout=30)
     if resp.status_code == 401:
-        # token invalid/expired; do not auto-refresh in this minimal script
+        # token invalid/expired; the next ensure_token() call logs in again
         return resp, None
     return resp, token
 
 
+def token_expiry(token: str) -> Optional[float]:
+    """Return the JWT ``exp`` claim as a UNIX timestamp, or None if it cannot be read."""
+    try:
+        payload = token.split(".")[1]
+        claims = json.loads(base64.urlsafe_b64decode(payload + "=" * (-len(payload) % 4)))
+        return float(claims["exp"])
+    except (IndexError, KeyError, TypeError, ValueError):
+        return None
+
+
+def ensure_token(
+    session: requests.Session,
+    token: Optional[str],
+    expires_at: Optional[float],
+    username: str,
+    password: str,
+    skew: float = TOKEN_REFRESH_SKEW_SEC,
+) -> Tuple[Optional[str], Optional[float]]:
+    """Reuse the token while it is valid; log in again only when it is missing or expires within ``skew``."""
+    if token and (expires_at is None or expires_at - time.time() > skew):
+        return token, expires_at
+    log("JWT missing or about to expire, logging in again...")
+    token = get_jwt(username=username, password=password, headless=False, session=session)
+    return token, (token_expiry(token) if token else None)
+
+
 def main() -> None:
     if get_jwt is None:
-        raise SystemExit("obs_login.py with Playwright is required to obtain JWT.")
+        raise SystemExit("obs_login.py is required to obtain JWT.")
 
     global TARGET_TIME, ADD_CRNS, DROP_CRNS
 
@@ -122,20 +315,28 @@ def main() -> None:
     if not ADD_CRNS and not DROP_CRNS:
         raise SystemExit("You must enter at least one CRN (ADD or DROP).")
 
-    log("Logging into OBS with Playwright to obtain JWT...")
-    token = get_jwt(username=username, password=password, headless=False)
+    session = make_session()
+    log("Logging into OBS to obtain JWT...")
+    token = get_jwt(username=username, password=password, headless=False, session=session)
     if not token:
         raise SystemExit("Failed to obtain JWT.")
+    expires_at = token_expiry(token)
 
-    session = requests.Session()
-    session.headers.update(default_headers())
-    wait_until(TARGET_TIME)
+    def refresh_before_target() -> None:
+        nonlocal token, expires_at
+        new_token, new_expires_at = ensure_token(
+            session, token, expires_at, username, password, skew=TOKEN_WAIT_SKEW_SEC
+        )
+        if new_token:
+            token, expires_at = new_token, new_expires_at
+        else:
+            log("Re-login failed; keeping the current JWT.")
+
+    wait_until(TARGET_TIME, warmup=lambda: warm_connection(session), refresh=refresh_before_target)
 
     resp, token = send_request(session, token)
-    log("Request #1 sent. Full response:")
-    print(f"Status: {resp.status_code}", flush=True)
-    print(f"Headers: {dict(resp.headers)}", flush=True)
-    print(f"Body: {resp.text}", flush=True)
+    log("Request #1 sent. Response:")
+    print_response(resp)
 
     while True:
         try:
@@ -144,11 +345,10 @@ def main() -> None:
             return
         if choice != "1":
             return
+        token, expires_at = ensure_token(session, token, expires_at, username, password)
         resp, token = send_request(session, token)
-        log("Extra request sent. Full response:")
-        print(f"Status: {resp.status_code}", flush=True)
-        print(f"Headers: {dict(resp.headers)}", flush=True)
-        print(f"Body: {resp.text}", flush=True)
+        log("Extra request sent. Response:")
+        print_response(resp)
 
 
 if __name__ == "__main__":
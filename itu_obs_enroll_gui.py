@@ -3,21 +3,76 @@
 
 """Simple graphical frontend for the ITU OBS enrollment script."""
 
+import queue
 import threading
-from typing import List, Optional
+import time
+from typing import Callable, List, Mapping, Optional, Union
 
 import customtkinter as ctk
 import requests
 
-from itu_obs_enroll import wait_until, default_headers
+from itu_obs_enroll import (
+    TOKEN_WAIT_SKEW_SEC,
+    build_headers_with_auth,
+    enrollment_body,
+    ensure_token,
+    make_session,
+    token_expiry,
+    wait_until,
+    warm_connection,
+)
 from obs_login import get_jwt
 
 
 DERS_KAYIT_URL = "https://obs.itu.edu.tr/api/ders-kayit/v21"
 
+# Number of identical enrollment POSTs fired at the target time, one connection each;
+# the first 2xx response back is shown.
+PARALLEL_POSTS = 4
+
+LOG_FLUSH_INTERVAL_MS = 100
+
+
+_CRN_WHITESPACE = str.maketrans("", "", " \t")
+
 
 def parse_crns(value: str) -> List[str]:
-    return [p.strip() for p in value.split(",") if p.strip()]
+    return [p for p in value.translate(_CRN_WHITESPACE).split(",") if p]
+
+
+def _post_when_released(
+    session: requests.Session,
+    warm_event: threading.Event,
+    fire_event: threading.Event,
+    cancel_event: threading.Event,
+    body: bytes,
+    headers_ref: List[Mapping[str, str]],
+) -> Optional[requests.Response]:
+    """Warm ``session`` when signalled, then POST once ``fire_event`` is set.
+
+    A worker whose warm-up is still running at the deadline posts as soon as it is done;
+    nothing else waits for it. Returns None without posting if ``cancel_event`` is set.
+    ``headers_ref[0]`` is read at fire time so a token refreshed during the wait is used.
+    """
+    warm_event.wait()
+    if cancel_event.is_set():
+        return None
+    warm_connection(session)
+    fire_event.wait()
+    if cancel_event.is_set():
+        return None
+    return session.post(DERS_KAYIT_URL, data=body, headers=headers_ref[0], timeout=30)
+
+
+def _put_result(
+    results: "queue.SimpleQueue[Union[requests.Response, Exception, None]]",
+    fn: Callable[..., Optional[requests.Response]],
+    *args,
+) -> None:
+    try:
+        results.put(fn(*args))
+    except Exception as exc:
+        results.put(exc)
 
 
 class EnrollApp(ctk.CTk):
@@ -31,7 +86,9 @@ class EnrollApp(ctk.CTk):
         ctk.set_appearance_mode("dark")
         ctk.set_default_color_theme("blue")
 
+        self._log_queue: "queue.SimpleQueue[str]" = queue.SimpleQueue()
         self._build_ui()
+        self.after(LOG_FLUSH_INTERVAL_MS, self._drain_log)
 
     def _build_ui(self) -> None:
         padding = {"padx": 16, "pady": 8}
@@ -104,11 +161,22 @@ class EnrollApp(ctk.CTk):
         footer.grid(row=8, column=0, columnspan=2, pady=(6, 0))
 
     def log(self, message: str) -> None:
-        self.log_text.configure(state="normal")
-        self.log_text.insert("end", message + "\n")
-        self.log_text.see("end")
-        self.log_text.configure(state="disabled")
-        self.update_idletasks()
+        # Safe from any thread; the Tk main loop writes queued lines in _drain_log.
+        self._log_queue.put(message)
+
+    def _drain_log(self) -> None:
+        lines = []
+        while True:
+            try:
+                lines.append(self._log_queue.get_nowait())
+            except queue.Empty:
+                break
+        if lines:
+            self.log_text.configure(state="normal")
+            self.log_text.insert("end", "\n".join(lines) + "\n")
+            self.log_text.see("end")
+            self.log_text.configure(state="disabled")
+        self.after(LOG_FLUSH_INTERVAL_MS, self._drain_log)
 
     def on_start(self) -> None:
         username = self.username_entry.get().strip()
@@ -145,34 +213,107 @@ class EnrollApp(ctk.CTk):
         add_crns: List[str],
         drop_crns: List[str],
     ) -> None:
+        # One session for login, warm-up and the first POST, so the connection to OBS is reused.
+        session = make_session()
+        sessions = [session]
         try:
             self.log("Logging into OBS to fetch JWT...")
-            token: Optional[str] = get_jwt(username=username, password=password, headless=False)
+            token: Optional[str] = get_jwt(
+                username=username, password=password, headless=False, session=session
+            )
             if not token:
                 self.log("Failed to obtain JWT. Aborting.")
                 return
 
-            session = requests.Session()
-            session.headers.update(default_headers())
-
-            self.log(f"Waiting until {target_time}...")
-            wait_until(target_time)
-
-            headers = default_headers()
-            headers["Authorization"] = f"Bearer {token}"
-            body = {"ECRN": add_crns, "SCRN": drop_crns}
-
-            self.log("Sending enrollment request...")
-            resp = session.post(DERS_KAYIT_URL, json=body, headers=headers, timeout=30)
-            self.log(f"Status: {resp.status_code}")
-            self.log(f"Headers: {dict(resp.headers)}")
-            self.log(f"Body: {resp.text}")
+            # Build everything for the POST before waiting, keeping only network I/O after the deadline.
+            headers_ref = [build_headers_with_auth(token)]
+            body = enrollment_body(tuple(add_crns), tuple(drop_crns))
+            expires_at = token_expiry(token)
+
+            def refresh_before_target() -> None:
+                nonlocal token, expires_at
+                # ensure_token() keeps a token without a readable expiry as-is
+                if expires_at is None or expires_at - time.time() > TOKEN_WAIT_SKEW_SEC:
+                    return
+                self.log("JWT expires soon, logging in again...")
+                new_token, new_expires_at = ensure_token(
+                    session, token, expires_at, username, password, skew=TOKEN_WAIT_SKEW_SEC
+                )
+                if not new_token:
+                    self.log("Re-login failed; keeping the current JWT.")
+                    return
+                token, expires_at = new_token, new_expires_at
+                headers_ref[0] = build_headers_with_auth(token)
+
+            # Extra sessions give each parallel POST its own pre-warmed connection.
+            sessions += [make_session() for _ in range(PARALLEL_POSTS - 1)]
+            self._fire_parallel(sessions, target_time, body, headers_ref, refresh_before_target)
 
         except Exception as exc:
             self.log(f"Unexpected error: {exc}")
         finally:
+            for s in sessions:
+                s.close()
             self.start_button.configure(state="normal")
 
+    def _fire_parallel(
+        self,
+        sessions: List[requests.Session],
+        target_time: str,
+        body: bytes,
+        headers_ref: List[Mapping[str, str]],
+        refresh: Callable[[], None],
+    ) -> None:
+        warm_event = threading.Event()
+        fire_event = threading.Event()
+        cancel_event = threading.Event()
+        results: "queue.SimpleQueue[Union[requests.Response, Exception, None]]" = queue.SimpleQueue()
+        # Daemon threads, like the enrollment thread itself: closing the window while we
+        # wait must end the process without any POST going out.
+        for s in sessions:
+            threading.Thread(
+                target=_put_result,
+                args=(results, _post_when_released, s, warm_event, fire_event, cancel_event, body, headers_ref),
+                daemon=True,
+            ).start()
+
+        self.log(f"Waiting until {target_time}...")
+        try:
+            wait_until(target_time, warmup=warm_event.set, refresh=refresh)
+        except BaseException:
+            cancel_event.set()
+            warm_event.set()
+            fire_event.set()
+            raise
+        fire_event.set()
+
+        # The first 2xx carries the enrollment result; earlier errors must not hide it.
+        # Once it is in, the remaining requests are abandoned: their sessions are closed by
+        # the caller and their threads die with the process.
+        first: Optional[requests.Response] = None
+        for _ in sessions:
+            resp = results.get()
+            if isinstance(resp, Exception):
+                self.log(f"Parallel request failed: {resp}")
+                continue
+            if 200 <= resp.status_code < 300:
+                self._log_response(
+                    f"Enrollment request sent ({len(sessions)} in parallel), first 2xx response:", resp
+                )
+                return
+            self.log(f"Other parallel response: {resp.status_code}")
+            first = first or resp
+        if first is None:
+            self.log("All enrollment requests failed.")
+            return
+        self._log_response("No 2xx response; first response received:", first)
+
+    def _log_response(self, title: str, resp: requests.Response) -> None:
+        self.log(title)
+        self.log(f"Status: {resp.status_code}")
+        self.log(f"Headers: {dict(resp.headers)}")
+        self.log(f"Body: {resp.text}")
+
 
 def main() -> None:
     app = EnrollApp()
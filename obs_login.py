@@ -1,84 +1,455 @@
 #!/usr/bin/env python3
 # -*- coding: utf-8 -*-
-"""Headless Playwright helper for logging into ITU OBS and retrieving a JWT."""
+"""Helper for logging into ITU OBS and retrieving a JWT (requests first, Playwright fallback)."""
 
+import atexit
+import hashlib
 import json
+import os
+import queue
 import re
-from typing import Optional
+import threading
+import time
+from concurrent.futures import Future
+from html.parser import HTMLParser
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util import Retry
 
 try:
-    from playwright.sync_api import sync_playwright, TimeoutError as PlaywrightTimeout
+    import orjson
+    _json_loads = orjson.loads
 except ImportError:
-    sync_playwright = None
-    PlaywrightTimeout = None
+    _json_loads = json.loads
 
 
 OBS_BASE_URL = "https://obs.itu.edu.tr"
 OBS_LOGIN_START = "https://obs.itu.edu.tr"
 JWT_URL = "https://obs.itu.edu.tr/ogrenci/auth/jwt"
 
+USER_AGENT = (
+    "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
+    "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
+)
+
 PAGE_LOAD_TIMEOUT_MS = 60_000
 NAVIGATION_TIMEOUT_MS = 45_000
-JWT_WAIT_AFTER_LOAD_MS = 3_000
+# How long a submitted login form may take to start navigating before the attempt is retried.
+LOGIN_SUBMIT_TIMEOUT_MS = 15_000
+
+_PASSWORD_FIELD_SELECTOR = "input[type='password'], input[name='Password'], input[name='password']"
+
+REQUEST_TIMEOUT_SEC = 15
+
+# Cookies of the last successful browser login per user; reused while younger than the max age.
+STORAGE_STATE_DIR = os.path.dirname(os.path.abspath(__file__))
+STORAGE_STATE_MAX_AGE_SEC = 30 * 60
+
+# Page-style headers for the login form; callers' sessions may default to JSON API headers.
+_FORM_HEADERS = {"Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8"}
 
 MAX_LOGIN_RETRIES = 3
 
+# Transient server errors on the plain-HTTP login are retried on the pooled connection.
+_LOGIN_RETRY = Retry(
+    total=3,
+    backoff_factor=0.2,
+    status_forcelist=[500, 502, 503, 504],
+    allowed_methods={"GET", "POST"},
+)
+
+# Jobs for the dedicated Playwright thread: (future, fn, args); fn=None stops it.
+_PLAYWRIGHT_JOBS: "queue.Queue" = queue.Queue()
+_PLAYWRIGHT_THREAD: Optional[threading.Thread] = None
+_PLAYWRIGHT_LOCK = threading.Lock()
+PLAYWRIGHT_STOP_TIMEOUT_SEC = 10
+
+_BLOCKED_RESOURCE_TYPES = frozenset({"image", "font", "media", "stylesheet"})
+
+# One round-trip to the page instead of a locator count() per selector: for each list of
+# selectors return the first one matching an element (invalid CSS is skipped) or null.
+_FIRST_MATCHING_SELECTORS_JS = """
+(categories) => categories.map((selectors) => selectors.find((sel) => {
+    try {
+        return document.querySelector(sel) !== null;
+    } catch (e) {
+        return false;
+    }
+}) ?? null)
+"""
+
+_JWT_RE = re.compile(r"^[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\Z")
+
+
+class _FormParser(HTMLParser):
+    """Collect every form's action and its input/button/select/textarea attributes.
+
+    A select's value is its selected option (else the first one) and a textarea's value
+    is its text, as a browser would submit them.
+    """
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.forms: List[Tuple[str, List[Dict[str, str]]]] = []
+        self._fields: Optional[List[Dict[str, str]]] = None
+        self._select: Optional[Dict[str, str]] = None
+        self._option: Optional[Dict[str, str]] = None
+        self._selected = False
+        self._textarea: Optional[Dict[str, str]] = None
+
+    def handle_starttag(self, tag: str, attrs) -> None:
+        if tag == "form":
+            self._fields = []
+            self.forms.append((dict(attrs).get("action") or "", self._fields))
+        elif self._fields is None:
+            return
+        elif tag in ("input", "button"):
+            field = {k: v or "" for k, v in attrs}
+            field.setdefault("type", "submit" if tag == "button" else "text")
+            self._fields.append(field)
+        elif tag in ("select", "textarea"):
+            field = {k: v or "" for k, v in attrs if k != "value"}
+            field["type"] = tag
+            self._fields.append(field)
+            if tag == "select":
+                self._select = field
+                self._selected = False
+            else:
+                field["value"] = ""
+                self._textarea = field
+        elif tag == "option" and self._select is not None:
+            self._end_option()
+            option = {k: v or "" for k, v in attrs}
+            if "value" not in option:
+                option["text"] = ""
+            self._option = option
+
+    def handle_data(self, data: str) -> None:
+        if self._textarea is not None:
+            self._textarea["value"] += data
+        elif self._option is not None and "text" in self._option:
+            self._option["text"] += data
+
+    def handle_endtag(self, tag: str) -> None:
+        if tag == "form":
+            self._fields = None
+        elif tag == "textarea":
+            self._textarea = None
+        elif tag == "option":
+            self._end_option()
+        elif tag == "select":
+            self._end_option()
+            self._select = None
+
+    def _end_option(self) -> None:
+        option, self._option = self._option, None
+        if option is None or self._select is None:
+            return
+        value = option["value"] if "value" in option else " ".join(option["text"].split())
+        if "value" not in self._select or ("selected" in option and not self._selected):
+            self._select["value"] = value
+            self._selected = "selected" in option
+
+
+def _build_login_form(html: str, username: str, password: str) -> Optional[Tuple[str, Dict[str, str]]]:
+    """Return (action, payload) for the form holding the password field, hidden inputs included."""
+    parser = _FormParser()
+    parser.feed(html)
+    for action, fields in parser.forms:
+        payload: Dict[str, str] = {}
+        user_field = pass_field = None
+        submitted = False
+        for field in fields:
+            name = field.get("name")
+            if not name:
+                continue
+            ftype = field["type"].lower()
+            if ftype == "password" and pass_field is None:
+                pass_field = name
+            elif ftype in ("text", "email") and user_field is None:
+                user_field = name
+            elif ftype == "submit":
+                if not submitted:
+                    payload[name] = field.get("value", "")
+                    submitted = True
+            elif ftype in ("checkbox", "radio"):
+                if "checked" in field:
+                    payload[name] = field.get("value", "on")
+            else:
+                payload[name] = field.get("value", "")
+        if user_field and pass_field:
+            payload[user_field] = username
+            payload[pass_field] = password
+            return action, payload
+    return None
+
+
+def get_jwt_with_requests(
+    username: str, password: str, session: Optional[requests.Session] = None
+) -> Optional[str]:
+    """Login by replaying the OBS login form with HTTPS requests and fetch JWT, no browser involved.
+
+    When ``session`` is given its cookies and pooled connections are reused and it is left open.
+    """
+    own_session = session is None
+    session = _login_session(session)
+    try:
+        page = session.get(OBS_LOGIN_START, headers=_FORM_HEADERS, timeout=REQUEST_TIMEOUT_SEC)
+        form = _build_login_form(page.text, username, password)
+        # No form usually means the session's cookies are still logged in and OBS served
+        # its own page; the JWT endpoint then answers without a login.
+        if form is not None:
+            action, payload = form
+            session.post(
+                urljoin(page.url, action),
+                data=payload,
+                headers={**_FORM_HEADERS, "Content-Type": "application/x-www-form-urlencoded"},
+                timeout=REQUEST_TIMEOUT_SEC,
+            )
+        resp = session.get(JWT_URL, headers={"Accept": "application/json"}, timeout=REQUEST_TIMEOUT_SEC)
+    except requests.RequestException:
+        return None
+    finally:
+        # a borrowed pool must stay open for the caller, so only close our own
+        if own_session:
+            session.close()
+    if resp.status_code != 200:
+        return None
+    return _extract_jwt_from_response(resp.text)
+
+
+def _login_session(session: Optional[requests.Session]) -> requests.Session:
+    """Session for the login requests, with ``_LOGIN_RETRY`` mounted.
+
+    A caller's session lends its headers, cookies and connection pool, so the JWT cookies
+    end up on it and the warmed-up sockets are reused; its own retry policy is not touched.
+    """
+    login = requests.Session()
+    adapter = HTTPAdapter(max_retries=_LOGIN_RETRY)
+    if session is not None:
+        login.headers = session.headers
+        login.cookies = session.cookies
+        adapter.poolmanager = session.get_adapter(OBS_BASE_URL).poolmanager
+    else:
+        login.headers["User-Agent"] = USER_AGENT
+    login.mount("https://", adapter)
+    return login
+
 
 def get_jwt_with_playwright(username: str, password: str, headless: bool = True) -> Optional[str]:
     """Login to OBS with Playwright, follow redirects and fetch JWT."""
-    if sync_playwright is None:
-        raise ImportError("Playwright is required: pip install playwright && playwright install chromium")
+    # Imported here so the GUI/CLI do not load Playwright unless the browser fallback is needed.
+    try:
+        import playwright.sync_api  # noqa: F401
+    except ImportError:
+        raise ImportError("Playwright is required: pip install playwright && playwright install chromium") from None
 
-    token: Optional[str] = None
-    for attempt in range(1, MAX_LOGIN_RETRIES + 1):
-        try:
-            token = _do_login_and_fetch_jwt(username, password, headless)
-            if token:
-                return token
-        except Exception:
-            continue
+    try:
+        return _run_on_playwright_thread(_login_with_browser, username, password, headless)
+    except Exception:
+        return None
+
+
+def _login_with_browser(playwright, username: str, password: str, headless: bool) -> Optional[str]:
+    state_path = _storage_state_path(username)
+    # One browser for all attempts; only the context is recreated on retry.
+    browser = playwright.chromium.launch(headless=headless)
+    try:
+        token = _fetch_jwt_with_saved_state(browser, state_path)
+        if token:
+            return token
+        for attempt in range(1, MAX_LOGIN_RETRIES + 1):
+            try:
+                token = _do_login_and_fetch_jwt(browser, username, password, state_path)
+                if token:
+                    return token
+            except _LoginRejected:
+                # retrying the same credentials would only be refused again
+                return None
+            except Exception:
+                continue
+    finally:
+        browser.close()
     return None
 
 
-def _do_login_and_fetch_jwt(username: str, password: str, headless: bool) -> Optional[str]:
-    with sync_playwright() as p:
-        browser = p.chromium.launch(headless=headless)
-        context = browser.new_context(
-            user_agent=(
-                "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 "
-                "(KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"
-            ),
-            ignore_https_errors=True,
-        )
-        context.set_default_navigation_timeout(NAVIGATION_TIMEOUT_MS)
-        context.set_default_timeout(PAGE_LOAD_TIMEOUT_MS)
-        page = context.new_page()
+def _run_on_playwright_thread(fn, *args):
+    """Run ``fn(playwright, *args)`` on the one long-lived thread that owns the driver.
+
+    The sync API is bound to the thread that started it. Funnelling every login through
+    this thread lets callers on short-lived threads (each GUI run) reuse one driver.
+    """
+    global _PLAYWRIGHT_THREAD
+    with _PLAYWRIGHT_LOCK:
+        if _PLAYWRIGHT_THREAD is None:
+            _PLAYWRIGHT_THREAD = threading.Thread(target=_playwright_worker, name="playwright", daemon=True)
+            _PLAYWRIGHT_THREAD.start()
+            atexit.register(_stop_playwright_thread)
+    future: Future = Future()
+    _PLAYWRIGHT_JOBS.put((future, fn, args))
+    return future.result()
+
+
+def _playwright_worker() -> None:
+    from playwright.sync_api import sync_playwright
 
+    playwright = None
+    while True:
+        future, fn, args = _PLAYWRIGHT_JOBS.get()
+        if fn is None:
+            if playwright is not None:
+                _stop_playwright(playwright)
+            future.set_result(None)
+            return
         try:
-            page.goto(OBS_LOGIN_START, wait_until="domcontentloaded")
-            page.wait_for_load_state("networkidle", timeout=PAGE_LOAD_TIMEOUT_MS)
-            page.wait_for_selector("input[type='password'], input[name='Password'], input[name='password']", timeout=15_000)
+            if playwright is None:
+                playwright = sync_playwright().start()
+            future.set_result(fn(playwright, *args))
+        except Exception as exc:
+            # launching or closing the browser failed; the driver may be the culprit,
+            # so start a fresh one for the next login
+            if playwright is not None:
+                _stop_playwright(playwright)
+                playwright = None
+            future.set_exception(exc)
 
-            _fill_and_submit_login(page, username, password)
 
-            page.wait_for_load_state("networkidle", timeout=PAGE_LOAD_TIMEOUT_MS)
-            page.wait_for_timeout(JWT_WAIT_AFTER_LOAD_MS)
+def _stop_playwright_thread() -> None:
+    future: Future = Future()
+    _PLAYWRIGHT_JOBS.put((future, None, ()))
+    try:
+        future.result(timeout=PLAYWRIGHT_STOP_TIMEOUT_SEC)
+    except Exception:
+        pass
+
+
+def _stop_playwright(playwright) -> None:
+    try:
+        playwright.stop()
+    except Exception:
+        pass
+
+
+def _do_login_and_fetch_jwt(browser, username: str, password: str, state_path: str) -> Optional[str]:
+    context = _new_context(browser)
+    try:
+        page = context.new_page()
+        page.goto(OBS_LOGIN_START, wait_until="domcontentloaded")
+        page.wait_for_selector(_PASSWORD_FIELD_SELECTOR, timeout=15_000)
+        _submit_login(page, username, password)
+
+        token = _fetch_jwt(context)
+        if token:
+            _save_storage_state(context, state_path)
+        return token
+    finally:
+        context.close()
+
+
+class _LoginRejected(RuntimeError):
+    """The login page came back with the password field, i.e. the credentials were refused."""
 
-            resp = page.request.get(
-                JWT_URL,
-                headers={"Accept": "application/json"},
-            )
-            if resp.status != 200:
-                return None
-            body = resp.text()
-            if not body:
-                return None
-            token = _extract_jwt_from_response(body)
-            return token
-        finally:
-            context.close()
-            browser.close()
-    return None
+
+def _submit_login(page, username: str, password: str) -> None:
+    """Submit the form and wait until the redirect chain lands back on OBS.
+
+    Wrong credentials bring the login page back, where waiting for OBS would burn the full
+    page-load timeout on every attempt, so a password field after the submit fails fast.
+    """
+    # A timeout here (nothing navigated yet, e.g. a slow server) propagates so the attempt
+    # loop retries; only a page that has actually reloaded counts as a rejection below.
+    with page.expect_navigation(wait_until="domcontentloaded", timeout=LOGIN_SUBMIT_TIMEOUT_MS):
+        _fill_and_submit_login(page, username, password)
+    if page.url.startswith(OBS_BASE_URL):
+        return
+    if page.query_selector(_PASSWORD_FIELD_SELECTOR) is not None:
+        raise _LoginRejected("Login page returned after submit")
+    # intermediate page (e.g. a script redirect) on the way back to OBS
+    page.wait_for_url(
+        lambda url: url.startswith(OBS_BASE_URL),
+        wait_until="domcontentloaded",
+        timeout=PAGE_LOAD_TIMEOUT_MS,
+    )
+
+
+def _save_storage_state(context, state_path: str) -> None:
+    """Best-effort cookie cache; a failed save must never cost the token already in hand."""
+    from playwright.sync_api import Error as PlaywrightError
+
+    try:
+        context.storage_state(path=state_path)
+    except (OSError, PlaywrightError):
+        pass
+
+
+def _new_context(browser, storage_state: Optional[str] = None):
+    context = browser.new_context(
+        user_agent=USER_AGENT,
+        ignore_https_errors=True,
+        storage_state=storage_state,
+    )
+    context.set_default_navigation_timeout(NAVIGATION_TIMEOUT_MS)
+    context.set_default_timeout(PAGE_LOAD_TIMEOUT_MS)
+    context.route("**/*", _skip_page_assets)
+    return context
+
+
+def _skip_page_assets(route) -> None:
+    """Abort image/font/media/CSS requests; the login form and JWT fetch do not need them."""
+    if route.request.resource_type in _BLOCKED_RESOURCE_TYPES:
+        route.abort()
+    else:
+        route.continue_()
+
+
+def _fetch_jwt(context) -> Optional[str]:
+    """GET the JWT endpoint with the context's cookies."""
+    resp = context.request.get(
+        JWT_URL,
+        headers={"Accept": "application/json"},
+    )
+    if resp.status != 200:
+        return None
+    body = resp.text()
+    if not body:
+        return None
+    return _extract_jwt_from_response(body)
+
+
+def _storage_state_path(username: str) -> str:
+    digest = hashlib.sha256(username.strip().lower().encode("utf-8")).hexdigest()[:16]
+    return os.path.join(STORAGE_STATE_DIR, f"obs_state_{digest}.json")
+
+
+def _fetch_jwt_with_saved_state(browser, state_path: str) -> Optional[str]:
+    """Fetch JWT with cookies saved by an earlier login, skipping the form if they still work."""
+    try:
+        if time.time() - os.path.getmtime(state_path) > STORAGE_STATE_MAX_AGE_SEC:
+            return None
+    except OSError:
+        return None
+    try:
+        # Playwright parses the file itself; a truncated or corrupt one raises here
+        context = _new_context(browser, storage_state=state_path)
+    except Exception:
+        _remove_storage_state(state_path)
+        return None
+    try:
+        return _fetch_jwt(context)
+    except Exception:
+        return None
+    finally:
+        context.close()
+
+
+def _remove_storage_state(state_path: str) -> None:
+    try:
+        os.remove(state_path)
+    except OSError:
+        pass
 
 
 def _fill_and_submit_login(page, username: str, password: str) -> None:
@@ -114,33 +485,23 @@ def _fill_and_submit_login(page, username: str, password: str) -> None:
         '[type="submit"]',
     ]
 
-    user_filled = False
-    for sel in username_selectors:
-        try:
-            loc = page.locator(sel)
-            if loc.count() > 0:
-                loc.first.fill(username)
-                user_filled = True
-                break
-        except Exception:
-            continue
-    if not user_filled:
+    user_sel, pass_sel, submit_sel = page.evaluate(
+        _FIRST_MATCHING_SELECTORS_JS, [username_selectors, password_selectors, submit_selectors]
+    )
+    if user_sel is None:
         raise RuntimeError("Username input field not found")
-
-    pass_filled = False
-    for sel in password_selectors:
-        try:
-            loc = page.locator(sel)
-            if loc.count() > 0:
-                loc.first.fill(password)
-                pass_filled = True
-                break
-        except Exception:
-            continue
-    if not pass_filled:
+    if pass_sel is None:
         raise RuntimeError("Password input field not found")
+    page.locator(user_sel).first.fill(username)
+    page.locator(pass_sel).first.fill(password)
 
+    if submit_sel is not None:
+        page.locator(submit_sel).first.click()
+        return
+    # :has-text() is Playwright-only syntax, so those selectors are resolved here instead
     for sel in submit_selectors:
+        if ":has-text(" not in sel:
+            continue
         try:
             btn = page.locator(sel)
             if btn.count() > 0:
@@ -156,10 +517,11 @@ def _extract_jwt_from_response(body: str) -> Optional[str]:
     body = (body or "").strip()
     if not body:
         return None
-    if re.match(r"^[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+\.[A-Za-z0-9_-]+$", body):
-        return body
+    if body[0] not in '{["':
+        # cannot be JSON, so it is either a bare JWT or nothing useful
+        return body if _JWT_RE.match(body) else None
     try:
-        data = json.loads(body)
+        data = _json_loads(body)
         if isinstance(data, dict):
             for key in ("token", "accessToken", "access_token", "jwt", "data"):
                 val = data.get(key)
@@ -174,12 +536,17 @@ def _extract_jwt_from_response(body: str) -> Optional[str]:
     return None
 
 
-def get_jwt(username: str, password: str, headless: bool = True) -> Optional[str]:
+def get_jwt(
+    username: str, password: str, headless: bool = True, session: Optional[requests.Session] = None
+) -> Optional[str]:
+    """Fetch JWT via the fast requests login; launch Playwright only if that fails."""
+    token = get_jwt_with_requests(username, password, session=session)
+    if token:
+        return token
     return get_jwt_with_playwright(username, password, headless=headless)
 
 
 if __name__ == "__main__":
-    import os
     USERNAME = os.environ.get("ITU_USERNAME", "")
     PASSWORD = os.environ.get("ITU_PASSWORD", "")
     if not USERNAME or not PASSWORD: